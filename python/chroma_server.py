@@ -7,22 +7,31 @@ Chroma向量数据库服务
 """
 
 import os
+import re
 import json
+import asyncio
+import functools
 import logging
 import argparse
 import sys
 import socket
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+import numpy as np
+
 # 设置stdout和stderr的编码为UTF-8
 if sys.stdout.encoding != 'utf-8':
     sys.stdout.reconfigure(encoding='utf-8')
 if sys.stderr.encoding != 'utf-8':
     sys.stderr.reconfigure(encoding='utf-8')
 
+import msgspec
 import uvicorn
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
@@ -31,10 +40,41 @@ try:
     import chromadb
     from chromadb.config import Settings
     from chromadb.utils import embedding_functions
+    from chromadb.api.types import EmbeddingFunction, Documents, Embeddings
 except ImportError:
     print("请先安装chromadb: pip install chromadb")
     raise
 
+# 可选依赖：FAISS提供HNSW近似最近邻索引，作为Chroma之外的可选后端
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# 可选依赖：scipy提供BLAS的sgemm，用于精确检索时计算内积
+try:
+    from scipy.linalg import blas as scipy_blas
+except ImportError:
+    scipy_blas = None
+
+# 可选依赖：onnxruntime的量化工具（需要onnx）用于将默认embedding模型量化为int8
+try:
+    import onnxruntime
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:
+    onnxruntime = None
+
+# 可选依赖：ormsgpack/orjson用于序列化查询结果，可直接处理numpy数组
+try:
+    import ormsgpack
+except ImportError:
+    ormsgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -67,11 +107,24 @@ class EmbeddingItem(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict)
     embedding: Optional[List[float]] = None
 
-class EmbeddingBatchItem(BaseModel):
+def _check_matrix(vectors: Optional[np.ndarray], field: str):
+    """向量数组必须是二维的且每行不为空（空列表除外），msgspec会将此处的ValueError转换为解析错误"""
+    if vectors is None or len(vectors) == 0:
+        return
+    if vectors.ndim != 2:
+        raise ValueError(f"{field}必须是二维数组，每一行为一个向量")
+    if vectors.shape[1] == 0:
+        raise ValueError(f"{field}中的向量不能为空")
+
+# 批量接口的请求体可能包含大量向量，使用msgspec解析，向量直接转换为float32数组
+class EmbeddingBatchItem(msgspec.Struct):
     ids: List[str]
     texts: List[str]
-    metadatas: List[Dict[str, Any]] = None
-    embeddings: Optional[List[List[float]]] = None
+    metadatas: Optional[List[Dict[str, Any]]] = None
+    embeddings: Optional[np.ndarray] = None
+    
+    def __post_init__(self):
+        _check_matrix(self.embeddings, "embeddings")
 
 class QueryItem(BaseModel):
     query_text: str
@@ -79,21 +132,765 @@ class QueryItem(BaseModel):
     where: Dict[str, Any] = None
     embedding: Optional[List[float]] = None
 
+class QueryBatchItem(msgspec.Struct):
+    query_texts: List[str] = []
+    query_embeddings: Optional[np.ndarray] = None
+    n_results: int = 5
+    where: Optional[Dict[str, Any]] = None
+    
+    def __post_init__(self):
+        _check_matrix(self.query_embeddings, "query_embeddings")
+
 class DeleteItem(BaseModel):
     ids: Optional[List[str]] = None
     where: Optional[Dict[str, Any]] = None
 
+def _dec_hook(type_, obj):
+    """msgspec自定义类型解码"""
+    if type_ is np.ndarray:
+        return np.asarray(obj, dtype=np.float32)
+    raise NotImplementedError(f"不支持的类型: {type_}")
+
+def _schema_hook(type_):
+    """msgspec自定义类型的JSON Schema"""
+    if type_ is np.ndarray:
+        return {"type": "array", "items": {"type": "array", "items": {"type": "number"}}}
+    raise NotImplementedError(f"不支持的类型: {type_}")
+
+def request_body_schema(struct_type) -> Dict[str, Any]:
+    """生成msgspec请求体的OpenAPI描述，通过openapi_extra声明到接口文档中"""
+    _, components = msgspec.json.schema_components([struct_type], schema_hook=_schema_hook)
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": components[struct_type.__name__]}}
+        }
+    }
+
+embedding_batch_decoder = msgspec.json.Decoder(EmbeddingBatchItem, dec_hook=_dec_hook)
+query_batch_decoder = msgspec.json.Decoder(QueryBatchItem, dec_hook=_dec_hook)
+
+async def decode_body(request: Request, decoder: msgspec.json.Decoder):
+    """使用msgspec解析请求体，跳过Pydantic逐个元素的校验"""
+    try:
+        return decoder.decode(await request.body())
+    except (msgspec.DecodeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 # 全局变量
 VECTOR_DB_PATH = None
 chroma_client = None
 openai_ef = None
 default_ef = None
 collections = {}
+faiss_collections = {}
+mmap_collections = {}
+executor = None
+# FAISS GPU资源，所有GPU索引共享
+gpu_resources = None
+# 保护collections/faiss_collections的创建，避免多个线程同时创建同一个collection
+_coll_lock = threading.RLock()
+# 正在执行的查询，相同参数的并发请求共享同一个结果
+_inflight: Dict[Tuple, asyncio.Task] = {}
+
+def _as_float32(vec) -> np.ndarray:
+    """转换为C连续的float32数组，便于FAISS和BLAS直接使用而无需复制"""
+    return np.ascontiguousarray(vec, dtype=np.float32)
+
+class CachedDefaultEmbeddingFunction(EmbeddingFunction):
+    """复用同一个ONNX模型实例的默认embedding函数
+    
+    新版本chromadb的DefaultEmbeddingFunction每次调用都会新建ONNXMiniLM_L6_V2并重新加载模型。
+    名称与DefaultEmbeddingFunction相同，与已有collection中记录的embedding函数一致。
+    """
+    
+    def __init__(self, model):
+        self.model = model
+    
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.model(input)
+    
+    @staticmethod
+    def name() -> str:
+        return "default"
+    
+    def get_config(self) -> Dict[str, Any]:
+        return {}
+    
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]):
+        return embedding_functions.DefaultEmbeddingFunction()
+
+def create_default_ef():
+    """创建默认embedding函数，返回(embedding函数, ONNX模型)，不支持时模型为None"""
+    model_class = getattr(embedding_functions, "ONNXMiniLM_L6_V2", None)
+    if model_class is None:
+        return embedding_functions.DefaultEmbeddingFunction(), None
+    model = model_class()
+    return CachedDefaultEmbeddingFunction(model), model
+
+def quantize_default_model(model, workers: int = 1):
+    """将默认embedding模型量化为int8并替换其ONNX会话
+    
+    量化后的模型保存在原模型旁边，只需生成一次。每个进程的推理线程数为CPU核数除以工作进程数，
+    多进程部署时不会互相争抢CPU。必须在开始处理请求之前调用，运行期间替换会话会让同一集合中
+    混入两个模型生成的向量，也会与正在进行的推理产生竞争。
+    """
+    if onnxruntime is None:
+        logger.info("未安装onnx，默认embedding模型使用float32推理")
+        return
+    try:
+        model._download_model_if_not_exists()
+        if hasattr(model, "_init_model_and_tokenizer"):
+            # 旧版本chromadb在首次调用时才初始化tokenizer，此时先初始化，之后不会覆盖替换的会话
+            model._init_model_and_tokenizer()
+        model_dir = os.path.join(model.DOWNLOAD_PATH, model.EXTRACTED_FOLDER_NAME)
+        model_path = os.path.join(model_dir, "model.onnx")
+        quant_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(quant_path):
+            # 先写入临时文件，多个进程同时量化时不会读到不完整的模型
+            tmp_path = f"{quant_path}.{os.getpid()}.tmp"
+            quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quant_path)
+            logger.info(f"已生成int8量化模型: {quant_path}")
+        
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model.model = onnxruntime.InferenceSession(
+            quant_path,
+            sess_options=sess_options,
+            providers=["CPUExecutionProvider"]
+        )
+        logger.info(f"默认embedding模型已切换为int8推理，线程数: {sess_options.intra_op_num_threads}")
+    except Exception as e:
+        logger.warning(f"量化默认embedding模型失败，继续使用float32推理: {e}")
+
+# 本地模型（ONNX/sentence-transformers）单次调用适合处理的文本数量
+EMBED_BATCH_SIZE = 32
+
+def _embed_in_chunks(ef, texts: List[str], chunk: Optional[int] = None) -> List[List[float]]:
+    """按模型的批量大小分块生成向量，避免逐条调用或一次性占满内存"""
+    chunk = chunk or EMBED_BATCH_SIZE
+    embeddings = []
+    for start in range(0, len(texts), chunk):
+        embeddings.extend(ef(texts[start:start + chunk]))
+    return embeddings
+
+def normalize_embeddings(vectors) -> np.ndarray:
+    """将向量归一化为单位长度，使内积等价于余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def embed_normalized(ef, texts: List[str]) -> np.ndarray:
+    """分块生成向量并归一化"""
+    return normalize_embeddings(_embed_in_chunks(ef, texts))
+
+@functools.lru_cache(maxsize=4096)
+def _embed_text(text: str) -> np.ndarray:
+    """生成单条查询文本的归一化向量并缓存（embedding模型输出是确定的）"""
+    vector = normalize_embeddings(default_ef([text]))[0]
+    # 缓存中的向量会被多个请求共享，禁止修改
+    vector.flags.writeable = False
+    return vector
+
+# 本地过滤支持的where运算符，大小比较只支持数值
+NUMERIC_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+WHERE_OPERATORS = ("$eq", "$ne", "$in", "$nin") + NUMERIC_OPERATORS
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_where(where: Optional[Dict[str, Any]]):
+    """检查where过滤条件，包含不支持的运算符或参数类型时抛出ValueError"""
+    if where is None:
+        return
+    if not isinstance(where, dict):
+        raise ValueError("where必须是对象")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list):
+                raise ValueError(f"{key}的值必须是列表")
+            for sub in condition:
+                validate_where(sub)
+        elif key.startswith("$"):
+            raise ValueError(f"不支持的运算符: {key}")
+        elif isinstance(condition, dict):
+            for op, target in condition.items():
+                if op not in WHERE_OPERATORS:
+                    raise ValueError(f"不支持的运算符: {op}")
+                if op in NUMERIC_OPERATORS and not _is_number(target):
+                    raise ValueError(f"{op}只能与数值比较")
+                if op in ("$in", "$nin") and not isinstance(target, list):
+                    raise ValueError(f"{op}的值必须是列表")
+
+def check_where(where: Optional[Dict[str, Any]], backend: str):
+    """faiss和mmap后端在本地过滤，查询前检查where条件"""
+    if backend == "chroma":
+        return
+    try:
+        validate_where(where)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"where条件无效: {e}")
+
+def _match_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """判断metadata是否满足where过滤条件（支持Chroma常用的比较与逻辑运算符）
+    
+    where需先经过validate_where检查；大小比较时metadata中的值不是数值则视为不满足。
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, target in condition.items():
+                if op == "$eq" and value != target:
+                    return False
+                if op == "$ne" and value == target:
+                    return False
+                if op == "$in" and value not in target:
+                    return False
+                if op == "$nin" and value in target:
+                    return False
+                if op in NUMERIC_OPERATORS:
+                    if not _is_number(value):
+                        return False
+                    if op == "$gt" and not value > target:
+                        return False
+                    if op == "$gte" and not value >= target:
+                        return False
+                    if op == "$lt" and not value < target:
+                        return False
+                    if op == "$lte" and not value <= target:
+                        return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+# 被覆盖和删除的向量超过索引总数的这一比例时重建索引
+FAISS_COMPACT_RATIO = 0.25
+# 写入后延迟保存的秒数，期间的多次写入合并为一次保存
+FAISS_PERSIST_DELAY = 1.0
+# int8量化的缩放系数：单位向量每个分量的绝对值不超过1，乘以127后正好落在int8范围内
+INT8_SCALE = 1 / 127
+
+class ReadWriteLock:
+    """读写锁：多个读者可以同时持有，写者独占；有写者等待时新的读者排在写者之后，写入不会被查询饿死"""
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class FaissCollection:
+    """基于FAISS HNSW索引的collection
+    
+    对外提供与Chroma Collection相同的add/query/delete接口，向量保存在FAISS索引中，
+    文本和metadata保存在同名的json文件中。HNSW索引不支持删除，被覆盖和删除的向量只从记录中
+    移除，查询时跳过；这类向量超过FAISS_COMPACT_RATIO后重建索引。
+    
+    每次保存都要写入整个索引，写入后延迟FAISS_PERSIST_DELAY秒统一保存，服务关闭时调用flush。
+    查询之间可以并发，只与add/delete/重建索引互斥；保存时先在读锁内把索引序列化到内存，
+    写入磁盘时不持有锁。
+    
+    quantization可选：
+    - "int8": 入库向量为单位向量，每个分量乘以127后以int8存储（IndexHNSWSQ），内存减少为1/4
+    - "binary": 按符号位压缩为比特（IndexBinaryHNSW），使用汉明距离，内存减少为1/32
+    
+    返回的距离为1 - 内积（即1 - 余弦相似度）；binary时为不同比特所占的比例（汉明距离除以维度），取值0~1。
+    """
+    
+    def __init__(self, name: str, persist_dir: str, embedding_function=None, hnsw_m: int = 32,
+                 quantization: Optional[str] = None):
+        self.name = name
+        self.embedding_function = embedding_function
+        self.hnsw_m = hnsw_m
+        self.quantization = quantization
+        self.index_path = os.path.join(persist_dir, f"{name}.index")
+        self.records_path = os.path.join(persist_dir, f"{name}.json")
+        self.index = None
+        # FAISS内部序号 -> {"id", "document", "metadata"}
+        self.records: Dict[int, Dict[str, Any]] = {}
+        # 外部ID -> FAISS内部序号
+        self.id_map: Dict[str, int] = {}
+        # 查询持有读锁，修改索引和记录持有写锁
+        self._lock = ReadWriteLock()
+        # 保证多次保存按顺序写入同一个临时文件
+        self._persist_lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._persist_timer: Optional[threading.Timer] = None
+        self._load()
+    
+    def _load(self):
+        """从磁盘加载索引和记录"""
+        if not os.path.exists(self.index_path) or not os.path.exists(self.records_path):
+            return
+        with open(self.records_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.quantization = data.get("quantization")
+        if self.quantization == "binary":
+            self.index = faiss.read_index_binary(self.index_path)
+        else:
+            self.index = faiss.read_index(self.index_path)
+        self.index.hnsw.efSearch = 64
+        for internal_id, record_id, document, metadata in data["records"]:
+            self.records[internal_id] = {"id": record_id, "document": document, "metadata": metadata}
+            self.id_map[record_id] = internal_id
+    
+    def persist(self):
+        """将索引和记录写入磁盘，先写临时文件再替换，保存中途退出不会损坏已有文件"""
+        with self._persist_lock:
+            with self._lock.read():
+                if self.index is None:
+                    return
+                # 序列化到内存只需复制一次，写磁盘时查询和写入都不需要等待
+                if self.quantization == "binary":
+                    index_bytes = faiss.serialize_index_binary(self.index)
+                else:
+                    index_bytes = faiss.serialize_index(self.index)
+                data = {
+                    "quantization": self.quantization,
+                    "records": [
+                        [internal_id, r["id"], r["document"], r["metadata"]]
+                        for internal_id, r in self.records.items()
+                    ]
+                }
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path + ".tmp", "wb") as f:
+                f.write(index_bytes.tobytes())
+            with open(self.records_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            os.replace(self.records_path + ".tmp", self.records_path)
+    
+    def schedule_persist(self):
+        """延迟保存，短时间内的多次写入只保存一次"""
+        with self._timer_lock:
+            if self._persist_timer is None:
+                self._persist_timer = threading.Timer(FAISS_PERSIST_DELAY, self._persist_scheduled)
+                self._persist_timer.daemon = True
+                self._persist_timer.start()
+    
+    def _cancel_persist(self):
+        with self._timer_lock:
+            if self._persist_timer is not None:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+    
+    def _persist_scheduled(self):
+        with self._timer_lock:
+            self._persist_timer = None
+        self.persist()
+    
+    def flush(self):
+        """取消等待中的延迟保存并立即保存"""
+        self._cancel_persist()
+        self.persist()
+    
+    def _maybe_compact(self):
+        """被覆盖和删除的向量过多时，用仍有效的向量重建索引"""
+        if self.index is None:
+            return
+        ntotal = self.index.ntotal
+        if ntotal - len(self.records) <= ntotal * FAISS_COMPACT_RATIO:
+            return
+        live = sorted(self.records)
+        index = self._create_index(self.index.d)
+        if live:
+            # 取出的是编码后的向量，直接写入新索引，不需要重新编码
+            index.add(self.index.reconstruct_n(0, ntotal)[live])
+        self.records = {new_id: self.records[old_id] for new_id, old_id in enumerate(live)}
+        self.id_map = {record["id"]: internal_id for internal_id, record in self.records.items()}
+        self.index = index
+        logger.info(f"已重建FAISS collection {self.name}的索引，移除{ntotal - len(live)}个失效向量")
+    
+    def _create_index(self, dim: int):
+        """按量化方式创建HNSW索引，dim为编码后的维度（binary时为比特数）
+        
+        入库向量已归一化，浮点索引使用内积度量。
+        """
+        if self.quantization == "int8":
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit_direct_signed, self.hnsw_m,
+                                      faiss.METRIC_INNER_PRODUCT)
+        elif self.quantization == "binary":
+            index = faiss.IndexBinaryHNSW(dim, self.hnsw_m)
+        else:
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 64
+        return index
+    
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """按collection的量化方式编码入库向量"""
+        if self.quantization == "int8":
+            return _as_float32(np.clip(np.round(vectors / INT8_SCALE), -127, 127))
+        if self.quantization == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return vectors
+    
+    def _encode_query(self, vectors: np.ndarray):
+        """编码查询向量，返回编码结果和每个查询内积结果的缩放系数"""
+        factors = np.ones(len(vectors), dtype=np.float32)
+        if self.quantization == "int8":
+            # 入库编码为x*127，查询按最大分量缩放到int8范围，两者的内积等于原始内积乘以127*factor
+            factors = 127 / np.maximum(np.abs(vectors).max(axis=1), 1e-12)
+            codes = _as_float32(np.round(vectors * factors[:, np.newaxis]))
+            return codes, factors / INT8_SCALE
+        return self._encode(vectors), factors
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        return embed_normalized(self.embedding_function, texts)
+    
+    def count(self) -> int:
+        return len(self.records)
+    
+    def add(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict[str, Any]]] = None, persist: bool = True):
+        """添加向量，已存在的ID会被覆盖；persist=False时不保存到磁盘，需自行调用flush"""
+        if embeddings is None:
+            vectors = self._embed(documents)
+        else:
+            vectors = _as_float32(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        codes = self._encode(vectors)
+        
+        with self._lock.write():
+            if self.index is None:
+                dim = codes.shape[1] * 8 if self.quantization == "binary" else codes.shape[1]
+                self.index = self._create_index(dim)
+            start = self.index.ntotal
+            self.index.add(codes)
+            for offset, (record_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+                old_internal_id = self.id_map.get(record_id)
+                if old_internal_id is not None:
+                    self.records.pop(old_internal_id, None)
+                self.records[start + offset] = {"id": record_id, "document": document, "metadata": metadata}
+                self.id_map[record_id] = start + offset
+            self._maybe_compact()
+        if persist:
+            self.schedule_persist()
+    
+    def query(self, query_embeddings=None, query_texts: Optional[List[str]] = None,
+              n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """查询相似向量，返回与Chroma相同结构的结果"""
+        if query_embeddings is None:
+            vectors = self._embed(query_texts)
+        else:
+            vectors = _as_float32(query_embeddings)
+        
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock.read():
+            if self.index is None:
+                for key in results:
+                    results[key] = [[] for _ in vectors]
+                return results
+            codes, factors = self._encode_query(vectors)
+            for vector, factor in zip(codes, factors):
+                hits = self._search_one(vector, n_results, where, float(factor))
+                results["ids"].append([self.records[i]["id"] for i, _ in hits])
+                results["documents"].append([self.records[i]["document"] for i, _ in hits])
+                results["metadatas"].append([self.records[i]["metadata"] for i, _ in hits])
+                results["distances"].append([d for _, d in hits])
+        return results
+    
+    def _search_one(self, vector: np.ndarray, n_results: int, where: Optional[Dict[str, Any]],
+                    factor: float = 1.0):
+        """搜索单个向量，跳过已删除和不满足过滤条件的记录"""
+        if self.index is None or not self.records:
+            return []
+        ntotal = self.index.ntotal
+        # 浮点和int8索引都使用内积度量，返回的是相似度，与Chroma的ip距离保持一致，转换为1 - 内积；
+        # binary索引返回汉明距离，除以比特数归一化到0~1
+        is_ip = self.quantization != "binary"
+        bits = self.index.d
+        # 先按已删除数量多取一些候选，不够时翻倍重试
+        k = min(ntotal, n_results + (ntotal - len(self.records)))
+        while True:
+            distances, labels = self.index.search(vector.reshape(1, -1), k)
+            hits = []
+            for internal_id, distance in zip(labels[0], distances[0]):
+                record = self.records.get(int(internal_id))
+                if record is None or not _match_where(record["metadata"], where):
+                    continue
+                hits.append((int(internal_id), 1.0 - float(distance) / factor if is_ip else float(distance) / bits))
+                if len(hits) == n_results:
+                    return hits
+            if k >= ntotal:
+                return hits
+            k = min(ntotal, k * 2)
+    
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """删除向量"""
+        with self._lock.write():
+            if ids:
+                targets = [self.id_map[i] for i in ids if i in self.id_map]
+            else:
+                targets = [i for i, r in self.records.items() if _match_where(r["metadata"], where)]
+            for internal_id in targets:
+                record = self.records.pop(internal_id)
+                self.id_map.pop(record["id"], None)
+            self._maybe_compact()
+        self.schedule_persist()
+    
+    def destroy(self):
+        """删除磁盘上的索引和记录文件"""
+        self._cancel_persist()
+        # 等待正在进行的保存完成，避免删除后又写入文件
+        with self._persist_lock, self._lock.write():
+            for path in (self.index_path, self.records_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.index = None
+            self.records = {}
+            self.id_map = {}
+
+def inner_products(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """计算每个查询与矩阵每一行的内积，返回(查询数, 行数)的分数"""
+    if matrix.shape[0] == 0:
+        # 过滤条件没有匹配任何行，BLAS不接受空矩阵
+        return np.empty((len(queries), 0), dtype=np.float32)
+    if scipy_blas is not None and matrix.flags.c_contiguous:
+        # 行优先的(N, d)矩阵转置后即为列优先的(d, N)，以trans参数交给BLAS计算matrix @ q，不复制矩阵
+        if len(queries) == 1:
+            return scipy_blas.sgemv(1.0, matrix.T, queries[0], trans=1)[np.newaxis, :]
+        return scipy_blas.sgemm(1.0, matrix.T, queries.T, trans_a=True).T
+    return queries @ matrix.T
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回分数最高的k个下标，按分数从高到低排列"""
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    # argpartition只需O(n)找出前k个，再对这k个排序
+    indices = np.argpartition(scores, n - k)[n - k:]
+    return indices[np.argsort(scores[indices])[::-1]]
+
+# 向量数不少于此值的mmap快照在有GPU时复制到GPU上检索
+GPU_MIN_VECTORS = int(os.environ.get("FAISS_GPU_MIN_VECTORS", "1000000"))
+# FAISS GPU暴力检索支持的最大k
+GPU_MAX_K = 2048
+# 向GPU索引添加向量时每次复制的行数
+GPU_ADD_CHUNK_SIZE = 65536
+
+def gpu_available() -> bool:
+    """是否安装了faiss-gpu且检测到GPU"""
+    return faiss is not None and hasattr(faiss, "get_num_gpus") and faiss.get_num_gpus() > 0
+
+class MmapCollection:
+    """从Chroma collection导出的只读快照
+    
+    归一化后的向量保存为.npy文件并以内存映射方式加载，查询时用一次矩阵乘法计算与全部
+    向量的内积，不经过SQLite；ID、文本和metadata保存在同名的json文件中。
+    适合读多写少的场景，Chroma中的数据更新后需要重新生成快照。
+    """
+    
+    def __init__(self, name: str, persist_dir: str, embedding_function=None):
+        self.name = name
+        self.embedding_function = embedding_function
+        self.vectors_path = os.path.join(persist_dir, f"{name}.npy")
+        self.records_path = os.path.join(persist_dir, f"{name}.json")
+        self.embeddings: Optional[np.ndarray] = None
+        self.ids: List[str] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        # 在后台构建完成后才会设置，之后无过滤条件的查询改用GPU
+        self.gpu_index = None
+        # FAISS的GPU索引不支持多线程同时检索
+        self._gpu_lock = threading.Lock()
+        self._load()
+    
+    def exists(self) -> bool:
+        return os.path.exists(self.vectors_path) and os.path.exists(self.records_path)
+    
+    def _load(self):
+        """以内存映射方式加载向量，只有被访问的页才会读入内存"""
+        if not self.exists():
+            return
+        with open(self.records_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.ids = data["ids"]
+        self.documents = data["documents"]
+        self.metadatas = data["metadatas"]
+        self.embeddings = np.load(self.vectors_path, mmap_mode="r")[:len(self.ids)]
+    
+    def count(self) -> int:
+        return len(self.ids)
+    
+    def wants_gpu(self) -> bool:
+        return self.count() >= GPU_MIN_VECTORS and gpu_available()
+    
+    def build_gpu_index(self):
+        """将快照向量分块复制到GPU上的IndexFlatIP（以float16存储），在后台线程中执行"""
+        global gpu_resources
+        try:
+            with _coll_lock:
+                if gpu_resources is None:
+                    gpu_resources = faiss.StandardGpuResources()
+            config = faiss.GpuIndexFlatConfig()
+            config.useFloat16 = True
+            index = faiss.GpuIndexFlatIP(gpu_resources, self.embeddings.shape[1], config)
+            # 直接分块写入GPU，不在内存中复制整个矩阵
+            for start in range(0, len(self.embeddings), GPU_ADD_CHUNK_SIZE):
+                index.add(np.ascontiguousarray(self.embeddings[start:start + GPU_ADD_CHUNK_SIZE]))
+            self.gpu_index = index
+            logger.info(f"已将mmap快照{self.name}的{index.ntotal}个向量复制到GPU")
+        except Exception as e:
+            logger.warning(f"构建GPU索引失败，继续使用CPU检索: {e}")
+    
+    def _query_gpu(self, vectors: np.ndarray, n_results: int) -> Dict[str, Any]:
+        """所有查询作为一个(B, d)矩阵在GPU上一次检索"""
+        k = min(n_results, self.count())
+        with self._gpu_lock:
+            scores, labels = self.gpu_index.search(vectors, k)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row_scores, row_labels in zip(scores, labels):
+            results["ids"].append([self.ids[i] for i in row_labels])
+            results["documents"].append([self.documents[i] for i in row_labels])
+            results["metadatas"].append([self.metadatas[i] for i in row_labels])
+            results["distances"].append(1.0 - row_scores)
+        return results
+    
+    def query(self, query_embeddings=None, query_texts: Optional[List[str]] = None,
+              n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """查询相似向量，返回与Chroma相同结构的结果，距离为1 - 内积"""
+        if query_embeddings is None:
+            vectors = embed_normalized(self.embedding_function, query_texts)
+        else:
+            vectors = _as_float32(query_embeddings)
+        
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if self.embeddings is None or not self.ids:
+            for key in results:
+                results[key] = [[] for _ in vectors]
+            return results
+        
+        gpu_index = self.gpu_index
+        if gpu_index is not None and not where and n_results <= GPU_MAX_K:
+            return self._query_gpu(vectors, n_results)
+        
+        # 有过滤条件时只在满足条件的行中计算
+        candidates = None
+        matrix = self.embeddings
+        if where:
+            candidates = np.flatnonzero([_match_where(m, where) for m in self.metadatas])
+            matrix = self.embeddings[candidates]
+        
+        # 所有查询一次矩阵乘法完成，单个查询时即为一次矩阵向量乘法
+        scores = inner_products(_as_float32(vectors), matrix)
+        for row in scores:
+            top = top_k(row, n_results)
+            indices = top if candidates is None else candidates[top]
+            results["ids"].append([self.ids[i] for i in indices])
+            results["documents"].append([self.documents[i] for i in indices])
+            results["metadatas"].append([self.metadatas[i] for i in indices])
+            results["distances"].append(1.0 - row[top])
+        return results
+    
+    def destroy(self):
+        """删除磁盘上的快照文件"""
+        self.gpu_index = None
+        self.embeddings = None
+        self.ids, self.documents, self.metadatas = [], [], []
+        for path in (self.vectors_path, self.records_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+# 生成快照时每次从Chroma读取的条数
+SNAPSHOT_PAGE_SIZE = 4096
+
+def build_snapshot(collection, persist_dir: str, name: str) -> int:
+    """将Chroma collection分页导出为mmap快照，返回导出的向量数
+    
+    向量逐页写入内存映射的临时文件，全部写完后再替换旧快照。
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    vectors_path = os.path.join(persist_dir, f"{name}.npy")
+    records_path = os.path.join(persist_dir, f"{name}.json")
+    total = collection.count()
+    vectors = None
+    data = {"ids": [], "documents": [], "metadatas": []}
+    for offset in range(0, total, SNAPSHOT_PAGE_SIZE):
+        page = collection.get(
+            limit=SNAPSHOT_PAGE_SIZE,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if len(page["ids"]) == 0:
+            break
+        embeddings = normalize_embeddings(page["embeddings"])
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(vectors_path + ".tmp", mode="w+", dtype=np.float32,
+                                                shape=(total, embeddings.shape[1]))
+        start = len(data["ids"])
+        vectors[start:start + len(embeddings)] = embeddings
+        data["ids"].extend(page["ids"])
+        data["documents"].extend(page["documents"])
+        data["metadatas"].extend(m or {} for m in page["metadatas"])
+    if vectors is None:
+        with open(vectors_path + ".tmp", "wb") as f:
+            np.save(f, np.empty((0, 0), dtype=np.float32))
+    else:
+        vectors.flush()
+        del vectors
+    with open(records_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    
+    # 替换前释放已加载的旧快照（Windows下不能替换仍被映射的文件）
+    with _coll_lock:
+        mmap_collections.pop(name, None)
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(records_path + ".tmp", records_path)
+    return len(data["ids"])
 
 @app.on_event("startup")
 async def startup_db_client():
     """初始化chromadb客户端和embedding功能"""
-    global VECTOR_DB_PATH, chroma_client, openai_ef, default_ef, collections
+    global VECTOR_DB_PATH, chroma_client, openai_ef, default_ef, collections, executor
+    
+    # Chroma的读写都是同步调用，放到线程池中执行以免阻塞事件循环
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    asyncio.get_running_loop().set_default_executor(executor)
     
     # 设置向量数据库路径
     VECTOR_DB_PATH = os.environ.get("VECTOR_DB_PATH", os.path.abspath("../resources/vector_db"))
@@ -125,84 +922,308 @@ async def startup_db_client():
             logger.warning(f"初始化OpenAI embedding函数失败: {e}")
             openai_ef = None
     
-    # 默认的embedding函数（可替换为其他本地模型）
-    default_ef = embedding_functions.DefaultEmbeddingFunction()
+    # 默认的embedding函数（可替换为其他本地模型），模型只加载一次
+    default_ef, model = create_default_ef()
     logger.info("已初始化默认embedding函数")
     
+    # 设置DEFAULT_EF_QUANTIZE=1时将模型量化为int8，在处理请求之前完成，所有向量都由同一个模型生成
+    if model is not None and os.environ.get("DEFAULT_EF_QUANTIZE", "0") == "1":
+        workers = int(os.environ.get("VECTOR_SERVER_WORKERS", "1"))
+        await run_sync(quantize_default_model, model, workers)
+    
+    # 预先加载默认collection，避免第一个请求读取磁盘
+    get_collection("default")
+    
     logger.info("Chroma向量数据库服务启动完成")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """关闭数据库连接"""
-    global chroma_client, collections
+    global chroma_client, collections, faiss_collections, mmap_collections, executor
+    # 保存还在等待延迟保存的FAISS collection
+    for collection in faiss_collections.values():
+        collection.flush()
     collections = {}
+    faiss_collections = {}
+    mmap_collections = {}
     chroma_client = None
+    _embed_text.cache_clear()
+    if executor is not None:
+        executor.shutdown(wait=False)
+        executor = None
     logger.info("Chroma向量数据库服务已关闭")
 
+async def run_sync(func, *args, **kwargs):
+    """在默认线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+async def single_flight(key: Tuple, func, *args, **kwargs):
+    """相同key的并发调用只执行一次func，后到的调用等待第一次调用的结果
+    
+    func在独立的task中执行，所有调用方（包括第一个）都通过shield等待，
+    某个调用方被取消（如客户端断开）时不会取消共享的task，其他调用方仍能拿到结果。
+    所有协程都运行在同一个事件循环中，查找和登记之间没有await，因此不需要加锁。
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(func(*args, **kwargs))
+        _inflight[key] = task
+        
+        def _done(t: asyncio.Future):
+            if _inflight.get(key) is t:
+                del _inflight[key]
+            # 标记异常已读取，所有调用方都被取消时不会输出警告
+            if not t.cancelled():
+                t.exception()
+        
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
 def get_collection(collection_name: str, embedding_function=None):
     """获取或创建一个collection"""
     global chroma_client, collections
     
-    if collection_name not in collections:
-        try:
-            # 尝试获取已存在的collection
-            collections[collection_name] = chroma_client.get_collection(
-                name=collection_name,
-                embedding_function=embedding_function or default_ef
-            )
-            logger.info(f"已获取collection: {collection_name}")
-        except Exception as e:
-            # 如果不存在则创建新的collection
-            collections[collection_name] = chroma_client.create_collection(
-                name=collection_name,
-                embedding_function=embedding_function or default_ef
+    # 已缓存的collection无需加锁
+    collection = collections.get(collection_name)
+    if collection is not None:
+        return collection
+    
+    with _coll_lock:
+        if collection_name not in collections:
+            try:
+                # 尝试获取已存在的collection
+                collections[collection_name] = chroma_client.get_collection(
+                    name=collection_name,
+                    embedding_function=embedding_function or default_ef
+                )
+                logger.info(f"已获取collection: {collection_name}")
+            except Exception as e:
+                # 如果不存在则创建新的collection
+                # 入库向量已归一化，使用内积距离
+                collections[collection_name] = chroma_client.create_collection(
+                    name=collection_name,
+                    embedding_function=embedding_function or default_ef,
+                    metadata={"hnsw:space": "ip"}
+                )
+                logger.info(f"已创建新的collection: {collection_name}")
+        
+        return collections[collection_name]
+
+# faiss和mmap后端的collection名称会作为文件名，沿用Chroma的命名规则，避免写到存储目录之外
+COLLECTION_NAME_PATTERN = re.compile(r"[a-zA-Z0-9][a-zA-Z0-9._-]{1,61}[a-zA-Z0-9]")
+
+def check_collection_name(collection_name: str):
+    """检查collection名称：3-63个字母、数字、点、下划线或连字符，首尾为字母或数字，不含连续的点"""
+    if not COLLECTION_NAME_PATTERN.fullmatch(collection_name) or ".." in collection_name:
+        raise HTTPException(status_code=400, detail=f"collection名称无效: {collection_name}")
+
+def get_faiss_dir() -> str:
+    """FAISS索引的存储目录"""
+    return os.path.join(VECTOR_DB_PATH, "faiss")
+
+QUANTIZATION_TYPES = ("int8", "binary")
+
+def get_faiss_collection(collection_name: str, embedding_function=None,
+                         quantization: Optional[str] = None) -> FaissCollection:
+    """获取或创建一个FAISS collection"""
+    global faiss_collections
+    
+    if faiss is None:
+        raise HTTPException(status_code=400, detail="未安装faiss，无法使用faiss后端: pip install faiss-cpu")
+    check_collection_name(collection_name)
+    
+    if quantization is not None and quantization not in QUANTIZATION_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的量化方式: {quantization}")
+    if quantization == "int8" and not hasattr(faiss.ScalarQuantizer, "QT_8bit_direct_signed"):
+        raise HTTPException(status_code=400, detail="当前faiss版本不支持int8量化，请升级: pip install -U faiss-cpu")
+    
+    collection = faiss_collections.get(collection_name)
+    if collection is None:
+        with _coll_lock:
+            if collection_name not in faiss_collections:
+                faiss_collections[collection_name] = FaissCollection(
+                    name=collection_name,
+                    persist_dir=get_faiss_dir(),
+                    embedding_function=embedding_function or default_ef,
+                    quantization=quantization
+                )
+                logger.info(f"已加载FAISS collection: {collection_name}")
+            collection = faiss_collections[collection_name]
+    
+    # 量化方式在collection创建时确定，之后不能更改
+    if quantization is not None and quantization != collection.quantization:
+        if collection.index is not None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"collection {collection_name} 的量化方式为{collection.quantization}，不能改为{quantization}"
             )
-            logger.info(f"已创建新的collection: {collection_name}")
+        collection.quantization = quantization
+    
+    return collection
+
+def get_mmap_dir() -> str:
+    """mmap快照的存储目录"""
+    return os.path.join(VECTOR_DB_PATH, "mmap")
+
+def get_mmap_collection(collection_name: str, embedding_function=None) -> MmapCollection:
+    """获取已生成快照的mmap collection"""
+    global mmap_collections
+    check_collection_name(collection_name)
+    
+    collection = mmap_collections.get(collection_name)
+    if collection is None:
+        with _coll_lock:
+            if collection_name not in mmap_collections:
+                collection = MmapCollection(
+                    name=collection_name,
+                    persist_dir=get_mmap_dir(),
+                    embedding_function=embedding_function or default_ef
+                )
+                if not collection.exists():
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"collection {collection_name} 没有快照，请先调用 POST /collection/{collection_name}/snapshot"
+                    )
+                mmap_collections[collection_name] = collection
+                logger.info(f"已加载mmap快照: {collection_name}")
+                # 数据量较大且有GPU时在后台构建GPU索引，构建完成前仍使用CPU检索
+                if collection.wants_gpu() and executor is not None:
+                    executor.submit(collection.build_gpu_index)
+            collection = mmap_collections[collection_name]
     
-    return collections[collection_name]
+    return collection
+
+def check_writable(collection):
+    """mmap快照是只读的，写入和删除需要通过chroma后端"""
+    if isinstance(collection, MmapCollection):
+        raise HTTPException(status_code=400, detail="mmap后端为只读快照，请写入chroma后端后重新生成快照")
+
+def to_backend_embeddings(collection, embeddings):
+    """Chroma需要列表形式的向量，FAISS和mmap后端直接使用numpy数组"""
+    if isinstance(embeddings, np.ndarray) and not isinstance(collection, (FaissCollection, MmapCollection)):
+        return embeddings.tolist()
+    return embeddings
+
+def to_cosine_distances(collection, results: Dict[str, Any]) -> Dict[str, Any]:
+    """将Chroma返回的距离统一为1 - 余弦相似度
+    
+    新建的集合使用内积距离，已经是1 - 余弦相似度；之前创建的集合默认使用l2（欧氏距离的平方），
+    对单位向量有 |a - b|^2 = 2 - 2cos，除以2即可换算。
+    """
+    if isinstance(collection, (FaissCollection, MmapCollection)):
+        return results
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "l2" and results.get("distances") is not None:
+        results["distances"] = [np.asarray(row, dtype=np.float32) / 2 for row in results["distances"]]
+    return results
+
+# 批量写入时每次写入collection的条数
+INGEST_CHUNK_SIZE = 512
+
+def add_in_chunks(collection, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]],
+                  embeddings: Optional[np.ndarray] = None, chunk: int = INGEST_CHUNK_SIZE):
+    """分块生成向量并写入collection，避免大批量写入时同时持有全部向量"""
+    for start in range(0, len(ids), chunk):
+        end = start + chunk
+        if embeddings is None:
+            chunk_embeddings = embed_normalized(default_ef, texts[start:end])
+        else:
+            # numpy切片是视图，不会复制原数组
+            chunk_embeddings = normalize_embeddings(embeddings[start:end])
+        collection.add(
+            ids=ids[start:end],
+            embeddings=to_backend_embeddings(collection, chunk_embeddings),
+            documents=texts[start:end],
+            metadatas=metadatas[start:end]
+        )
+        del chunk_embeddings
+
+def resolve_collection(collection_name: str, backend: str = "chroma", quantization: Optional[str] = None):
+    """根据后端类型获取collection"""
+    if backend == "chroma":
+        if quantization is not None:
+            raise HTTPException(status_code=400, detail="量化存储仅支持faiss后端")
+        return get_collection(collection_name)
+    if backend == "faiss":
+        return get_faiss_collection(collection_name, quantization=quantization)
+    if backend == "mmap":
+        if quantization is not None:
+            raise HTTPException(status_code=400, detail="量化存储仅支持faiss后端")
+        return get_mmap_collection(collection_name)
+    raise HTTPException(status_code=400, detail=f"不支持的后端: {backend}")
+
+def json_bytes(payload: Any) -> bytes:
+    """将结果序列化为JSON字节串，优先使用orjson，numpy数组无需先转换为列表"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, ensure_ascii=False, default=lambda o: o.tolist()).encode("utf-8")
+
+def json_response(payload: Any) -> Response:
+    """直接返回序列化好的JSON，跳过FastAPI对返回值的逐层转换"""
+    return Response(content=json_bytes(payload), media_type="application/json")
+
+# 内容固定的响应在启动时序列化一次，每次请求直接返回
+ROOT_BODY = json_bytes({"status": "ok", "message": "NovelAssist向量数据库服务运行中"})
+HEALTH_BODY = json_bytes({"status": "ok"})
 
 @app.get("/")
 async def root():
     """API根路径"""
-    return {"status": "ok", "message": "NovelAssist向量数据库服务运行中"}
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 @app.get("/collections")
-async def list_collections():
+async def list_collections(backend: str = "chroma"):
     """列出所有collections"""
-    collections_list = chroma_client.list_collections()
-    return {"collections": [c.name for c in collections_list]}
+    if backend in ("faiss", "mmap"):
+        directory, suffix = (get_faiss_dir(), ".index") if backend == "faiss" else (get_mmap_dir(), ".npy")
+        names = set()
+        if os.path.isdir(directory):
+            names.update(Path(p).stem for p in os.listdir(directory) if p.endswith(suffix))
+        # 刚写入的FAISS collection在延迟保存之前只存在于内存中
+        if backend == "faiss":
+            names.update(faiss_collections.keys())
+        return json_response({"collections": sorted(names)})
+    collections_list = await run_sync(chroma_client.list_collections)
+    return json_response({"collections": [c.name for c in collections_list]})
 
 @app.post("/embed")
-async def create_embedding(item: EmbeddingItem, collection_name: str = "default"):
+async def create_embedding(item: EmbeddingItem, collection_name: str = "default", backend: str = "chroma",
+                           quantization: Optional[str] = None):
     """创建单个文本的向量嵌入并存储"""
     try:
-        collection = get_collection(collection_name)
+        collection = await run_sync(resolve_collection, collection_name, backend, quantization)
+        check_writable(collection)
         
-        # 如果没有提供embedding，则使用collection的embedding函数生成
+        # 如果没有提供embedding，则使用默认embedding函数生成，并归一化为单位向量
         if not item.embedding:
-            collection.add(
-                ids=[item.id],
-                documents=[item.text],
-                metadatas=[item.metadata]
-            )
+            embeddings = await run_sync(embed_normalized, default_ef, [item.text])
         else:
-            collection.add(
-                ids=[item.id],
-                embeddings=[item.embedding],
-                documents=[item.text],
-                metadatas=[item.metadata]
-            )
+            embeddings = normalize_embeddings(item.embedding)
+        
+        await run_sync(
+            collection.add,
+            ids=[item.id],
+            embeddings=to_backend_embeddings(collection, embeddings),
+            documents=[item.text],
+            metadatas=[item.metadata]
+        )
         
         return {"status": "success", "message": f"已将文本向量化并添加到{collection_name}"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"创建向量嵌入失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/embed_batch")
-async def create_embeddings_batch(item: EmbeddingBatchItem, collection_name: str = "default"):
+@app.post("/embed_batch", openapi_extra=request_body_schema(EmbeddingBatchItem))
+async def create_embeddings_batch(request: Request, collection_name: str = "default", backend: str = "chroma",
+                                  quantization: Optional[str] = None):
     """批量创建文本的向量嵌入并存储"""
     try:
-        collection = get_collection(collection_name)
+        item: EmbeddingBatchItem = await decode_body(request, embedding_batch_decoder)
+        collection = await run_sync(resolve_collection, collection_name, backend, quantization)
+        check_writable(collection)
         
         # 检查输入数据长度是否一致
         if len(item.ids) != len(item.texts):
@@ -211,35 +1232,167 @@ async def create_embeddings_batch(item: EmbeddingBatchItem, collection_name: str
         # 如果没有提供metadata，则创建一个空列表
         metadatas = item.metadatas if item.metadatas else [{}] * len(item.ids)
         
-        # 如果没有提供embeddings，则使用collection的embedding函数生成
-        if not item.embeddings:
-            collection.add(
-                ids=item.ids,
-                documents=item.texts,
-                metadatas=metadatas
-            )
+        # 如果没有提供embeddings，则在写入时分块生成
+        if item.embeddings is None or len(item.embeddings) == 0:
+            embeddings = None
         else:
             # 检查embeddings长度是否一致
             if len(item.embeddings) != len(item.ids):
                 raise HTTPException(status_code=400, detail="embeddings和ids的长度必须一致")
-            
-            collection.add(
-                ids=item.ids,
-                embeddings=item.embeddings,
-                documents=item.texts,
-                metadatas=metadatas
-            )
+            embeddings = item.embeddings
+        
+        # 分块写入，每块向量归一化后再写入
+        await run_sync(add_in_chunks, collection, item.ids, item.texts, metadatas, embeddings)
         
         return {"status": "success", "message": f"已批量添加{len(item.ids)}个向量到{collection_name}"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"批量创建向量嵌入失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+def encode_response(request: Request, payload: Dict[str, Any]) -> Response:
+    """根据Accept头将结果序列化为msgpack或JSON，numpy数组无需先转换为列表"""
+    if MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        if ormsgpack is None:
+            raise HTTPException(status_code=406, detail="未安装ormsgpack，无法返回msgpack格式")
+        return Response(
+            content=ormsgpack.packb(payload, option=ormsgpack.OPT_SERIALIZE_NUMPY),
+            media_type=MSGPACK_MEDIA_TYPE
+        )
+    
+    return json_response(payload)
+
+def _result_row(results: Dict[str, Any], key: str, j: int):
+    """取第j个查询结果中的某一列，缺失时返回None"""
+    column = results.get(key)
+    if column is None or len(column) <= j or column[j] is None or len(column[j]) == 0:
+        return None
+    return column[j]
+
+# 查询结果的返回格式：soa为按列返回，aos为兼容旧接口的逐条返回
+RESULT_FORMATS = ("soa", "aos")
+
+def check_result_format(result_format: str):
+    """检查查询结果的返回格式"""
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的返回格式: {result_format}")
+
+def format_query_columns(results: Dict[str, Any], j: int) -> Dict[str, Any]:
+    """按列返回第j个查询的结果，不为每条结果单独创建dict"""
+    distances = _result_row(results, "distances", j)
+    return {
+        "ids": results["ids"][j],
+        "documents": _result_row(results, "documents", j),
+        "metadatas": _result_row(results, "metadatas", j),
+        # 距离保持为float32，由序列化器直接处理
+        "distances": np.asarray(distances, dtype=np.float32) if distances is not None else None
+    }
+
+def format_query_results(results: Dict[str, Any], j: int) -> List[Dict[str, Any]]:
+    """将第j个查询的结果转换为逐条的格式（format=aos）"""
+    processed_results = []
+    
+    ids = results["ids"][j]
+    documents = _result_row(results, "documents", j)
+    metadatas = _result_row(results, "metadatas", j)
+    distances = _result_row(results, "distances", j)
+    if distances is not None:
+        # 距离保持为float32，由序列化器直接处理
+        distances = np.asarray(distances, dtype=np.float32)
+    
+    for i in range(len(ids)):
+        item = {
+            "id": ids[i],
+            "text": documents[i] if documents is not None else None,
+            "metadata": metadatas[i] if metadatas is not None else {},
+            "distance": distances[i] if distances is not None else None
+        }
+        processed_results.append(item)
+    
+    return processed_results
+
+async def run_query(collection, query: QueryItem) -> Dict[str, Any]:
+    """生成查询向量并查询collection"""
+    # 查询参数
+    query_params = {
+        "n_results": query.n_results
+    }
+    
+    # 添加过滤条件（如果有）
+    if query.where:
+        query_params["where"] = query.where
+    
+    # 如果没有提供embedding，则生成查询文本的向量（相同文本直接命中缓存）
+    # 查询向量与入库向量一样归一化
+    if query.embedding:
+        embeddings = normalize_embeddings(query.embedding)
+    else:
+        embeddings = (await run_sync(_embed_text, query.query_text))[np.newaxis, :]
+    
+    results = await run_sync(
+        collection.query,
+        query_embeddings=to_backend_embeddings(collection, embeddings),
+        **query_params
+    )
+    return to_cosine_distances(collection, results)
+
 @app.post("/query")
-async def query_similar(query: QueryItem, collection_name: str = "default"):
+async def query_similar(query: QueryItem, request: Request, collection_name: str = "default", backend: str = "chroma",
+                        result_format: str = Query("soa", alias="format")):
     """查询相似向量"""
     try:
-        collection = get_collection(collection_name)
+        check_result_format(result_format)
+        collection = await run_sync(resolve_collection, collection_name, backend)
+        check_where(query.where, backend)
+        
+        # 相同参数的并发查询只执行一次
+        key = (
+            collection_name,
+            backend,
+            query.query_text,
+            tuple(query.embedding) if query.embedding else None,
+            query.n_results,
+            json.dumps(query.where, sort_keys=True, ensure_ascii=False)
+        )
+        results = await single_flight(key, run_query, collection, query)
+        
+        # 只查询了一个文本/向量，因此只有一组查询结果
+        if result_format == "aos":
+            processed_results = format_query_results(results, 0)
+            return encode_response(request, {
+                "status": "success",
+                "results": processed_results,
+                "count": len(processed_results)
+            })
+        
+        columns = format_query_columns(results, 0)
+        return encode_response(request, {
+            "status": "success",
+            **columns,
+            "count": len(columns["ids"])
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查询相似向量失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/query_batch", openapi_extra=request_body_schema(QueryBatchItem))
+async def query_similar_batch(request: Request, collection_name: str = "default", backend: str = "chroma",
+                              result_format: str = Query("soa", alias="format")):
+    """批量查询相似向量，所有查询在一次collection.query调用中完成"""
+    try:
+        check_result_format(result_format)
+        query: QueryBatchItem = await decode_body(request, query_batch_decoder)
+        collection = await run_sync(resolve_collection, collection_name, backend)
+        
+        has_embeddings = query.query_embeddings is not None and len(query.query_embeddings) > 0
+        if not query.query_texts and not has_embeddings:
+            raise HTTPException(status_code=400, detail="必须提供query_texts或query_embeddings参数")
+        check_where(query.where, backend)
         
         # 查询参数
         query_params = {
@@ -250,83 +1403,144 @@ async def query_similar(query: QueryItem, collection_name: str = "default"):
         if query.where:
             query_params["where"] = query.where
         
-        # 如果提供了embedding则使用，否则使用文本查询
-        if query.embedding:
-            results = collection.query(
-                query_embeddings=[query.embedding],
-                **query_params
-            )
+        # 如果提供了embeddings则使用，否则批量生成查询文本的向量，并归一化
+        if has_embeddings:
+            embeddings = await run_sync(normalize_embeddings, query.query_embeddings)
         else:
-            results = collection.query(
-                query_texts=[query.query_text],
-                **query_params
-            )
+            embeddings = await run_sync(embed_normalized, default_ef, query.query_texts)
         
-        # 处理结果，将其转换为更易于前端使用的格式
-        processed_results = []
+        results = await run_sync(
+            collection.query,
+            query_embeddings=to_backend_embeddings(collection, embeddings),
+            **query_params
+        )
+        results = to_cosine_distances(collection, results)
         
-        # 假设只有一组查询结果（因为我们只查询了一个文本/向量）
-        for i in range(len(results["ids"][0])):
-            item = {
-                "id": results["ids"][0][i],
-                "text": results["documents"][0][i] if results["documents"] and results["documents"][0] else None,
-                "metadata": results["metadatas"][0][i] if results["metadatas"] and results["metadatas"][0] else {},
-                "distance": results["distances"][0][i] if results["distances"] and results["distances"][0] else None
-            }
-            processed_results.append(item)
+        # 按输入顺序返回每个查询的结果
+        formatter = format_query_results if result_format == "aos" else format_query_columns
+        batch_results = [formatter(results, j) for j in range(len(results["ids"]))]
         
-        return {
+        return encode_response(request, {
             "status": "success",
-            "results": processed_results,
-            "count": len(processed_results)
-        }
+            "results": batch_results,
+            "count": len(batch_results)
+        })
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"查询相似向量失败: {e}")
+        logger.error(f"批量查询相似向量失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/query_exact")
+async def query_exact(request: Request, query_text: str, n_results: int = 5, collection_name: str = "default",
+                      result_format: str = Query("soa", alias="format")):
+    """在mmap快照上精确检索（与全部向量计算内积），结果不受HNSW近似误差影响"""
+    try:
+        check_result_format(result_format)
+        collection = await run_sync(get_mmap_collection, collection_name)
+        embeddings = (await run_sync(_embed_text, query_text))[np.newaxis, :]
+        results = await run_sync(collection.query, query_embeddings=embeddings, n_results=n_results)
+        
+        if result_format == "aos":
+            processed_results = format_query_results(results, 0)
+            return encode_response(request, {
+                "status": "success",
+                "results": processed_results,
+                "count": len(processed_results)
+            })
+        
+        columns = format_query_columns(results, 0)
+        return encode_response(request, {
+            "status": "success",
+            **columns,
+            "count": len(columns["ids"])
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"精确检索失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/delete")
-async def delete_embeddings(delete_item: DeleteItem, collection_name: str = "default"):
+async def delete_embeddings(delete_item: DeleteItem, collection_name: str = "default", backend: str = "chroma"):
     """删除向量"""
     try:
-        collection = get_collection(collection_name)
+        collection = await run_sync(resolve_collection, collection_name, backend)
+        check_writable(collection)
+        check_where(delete_item.where, backend)
         
         # 按ID删除
         if delete_item.ids:
-            collection.delete(ids=delete_item.ids)
+            await run_sync(collection.delete, ids=delete_item.ids)
             return {"status": "success", "message": f"已从{collection_name}中删除{len(delete_item.ids)}个向量"}
         
         # 按条件删除
         elif delete_item.where:
-            collection.delete(where=delete_item.where)
+            await run_sync(collection.delete, where=delete_item.where)
             return {"status": "success", "message": f"已从{collection_name}中删除符合条件的向量"}
         
         else:
             raise HTTPException(status_code=400, detail="必须提供ids或where参数")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"删除向量失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/collection/{collection_name}")
-async def delete_collection(collection_name: str):
+async def delete_collection(collection_name: str, backend: str = "chroma"):
     """删除整个collection"""
     try:
-        global collections
+        global collections, faiss_collections, mmap_collections
+        
+        if backend == "faiss":
+            collection = await run_sync(get_faiss_collection, collection_name)
+            await run_sync(collection.destroy)
+            with _coll_lock:
+                faiss_collections.pop(collection_name, None)
+            return {"status": "success", "message": f"已删除collection: {collection_name}"}
+        
+        if backend == "mmap":
+            # 只删除快照，不影响chroma中的数据
+            collection = await run_sync(get_mmap_collection, collection_name)
+            with _coll_lock:
+                mmap_collections.pop(collection_name, None)
+            await run_sync(collection.destroy)
+            return {"status": "success", "message": f"已删除collection快照: {collection_name}"}
         
-        chroma_client.delete_collection(name=collection_name)
+        await run_sync(chroma_client.delete_collection, name=collection_name)
         
         # 从缓存中移除
-        if collection_name in collections:
-            del collections[collection_name]
+        with _coll_lock:
+            collections.pop(collection_name, None)
         
         return {"status": "success", "message": f"已删除collection: {collection_name}"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"删除collection失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/collection/{collection_name}/snapshot")
+async def snapshot_collection(collection_name: str):
+    """将chroma collection导出为mmap后端使用的只读快照，已有快照会被替换"""
+    try:
+        check_collection_name(collection_name)
+        collection = await run_sync(get_collection, collection_name)
+        count = await run_sync(build_snapshot, collection, get_mmap_dir(), collection_name)
+        # 立即加载新快照，需要时开始构建GPU索引
+        await run_sync(get_mmap_collection, collection_name)
+        return {"status": "success", "message": f"已为{collection_name}生成快照，共{count}个向量"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"生成collection快照失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "ok"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 if __name__ == "__main__":
     # 命令行参数
@@ -335,6 +1549,7 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=8000, help="端口号")
     parser.add_argument("--db-path", default=None, help="向量数据库路径")
     parser.add_argument("--auto-port", action="store_true", help="自动选择可用端口")
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数，默认为1")
     args = parser.parse_args()
     
     # 设置数据库路径环境变量
@@ -365,6 +1580,23 @@ if __name__ == "__main__":
                 logger.error("无法找到可用端口，服务启动失败")
                 sys.exit(1)
     
+    # 各工作进程按进程数分配embedding模型的推理线程
+    os.environ["VECTOR_SERVER_WORKERS"] = str(args.workers)
+    
+    # Chroma的PersistentClient不支持多个进程同时写入同一个数据库目录
+    if args.workers > 1:
+        logger.warning(f"使用{args.workers}个工作进程，多个进程同时写入同一数据库可能导致数据损坏，建议仅用于只读查询")
+    
     # 启动服务
+    # 安装uvicorn[standard]后会自动使用uvloop事件循环和httptools解析HTTP
     logger.info(f"正在启动服务，监听地址: {args.host}:{port}")
-    uvicorn.run(app, host=args.host, port=port) 
\ No newline at end of file
+    uvicorn.run(
+        # 多进程模式下uvicorn需要通过导入路径加载应用
+        "chroma_server:app" if args.workers > 1 else app,
+        host=args.host,
+        port=port,
+        workers=args.workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        access_log=False,
+        backlog=2048
+    ) 
\ No newline at end of file
@@ -8,6 +8,7 @@ Python依赖安装脚本
 
 import os
 import sys
+import shutil
 import subprocess
 import platform
 
@@ -18,12 +19,34 @@ def get_pip_cmd():
     else:  # Linux/Mac
         return 'pip3'
 
+def get_install_cmd(requirements_path):
+    """获取安装依赖的命令，已安装uv时优先使用uv"""
+    uv_cmd = shutil.which('uv')
+    if uv_cmd:
+        # uv并行解析和下载依赖，安装到运行本脚本的Python环境中
+        return [uv_cmd, 'pip', 'install', '--python', sys.executable, '-r', requirements_path]
+    return [get_pip_cmd(), 'install', '-r', requirements_path]
+
+def run_command(cmd):
+    """执行命令并逐行输出，返回命令是否执行成功"""
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, bufsize=1, errors='replace')
+    except OSError as e:
+        print(f"无法执行命令: {e}")
+        return False
+    
+    # 边读边输出，安装过程实时可见，输出较多时也不会塞满管道
+    with proc.stdout:
+        for line in proc.stdout:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    return proc.wait() == 0
+
 def install_dependencies():
     """安装向量数据库服务所需的依赖"""
     print("开始安装依赖...")
     
-    pip_cmd = get_pip_cmd()
-    
     # 获取当前脚本目录
     script_dir = os.path.dirname(os.path.abspath(__file__))
     requirements_path = os.path.join(script_dir, 'requirements.txt')
@@ -33,23 +56,16 @@ def install_dependencies():
         print(f"错误: 找不到依赖文件 {requirements_path}")
         return False
     
-    try:
-        # 执行pip安装命令
-        cmd = [pip_cmd, 'install', '-r', requirements_path]
-        print(f"执行命令: {' '.join(cmd)}")
-        
-        process = subprocess.run(cmd, check=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-        
-        # 输出安装结果
-        print(process.stdout)
-        
-        print("依赖安装完成!")
-        return True
+    # 执行安装命令
+    cmd = get_install_cmd(requirements_path)
+    print(f"执行命令: {' '.join(cmd)}")
     
-    except subprocess.CalledProcessError as e:
-        print(f"安装依赖失败: {e}")
-        print(f"错误信息: {e.stderr}")
+    if not run_command(cmd):
+        print("安装依赖失败，错误信息见上方的安装输出")
         return False
+    
+    print("依赖安装完成!")
+    return True
 
 def check_python_version():
     """检查Python版本"""
@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+
+"""chroma_server中不依赖embedding模型的后端逻辑测试"""
+
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chroma_server as cs
+
+
+def _unit_vectors(n, dim=16, seed=0):
+    rng = cs.np.random.default_rng(seed)
+    return cs.normalize_embeddings(rng.standard_normal((n, dim)))
+
+
+# where过滤
+
+@pytest.mark.parametrize("where, expected", [
+    (None, True),
+    ({"k": 2}, True),
+    ({"k": 3}, False),
+    ({"k": {"$eq": 2}}, True),
+    ({"k": {"$ne": 2}}, False),
+    ({"k": {"$in": [1, 2]}}, True),
+    ({"k": {"$nin": [1, 2]}}, False),
+    ({"k": {"$gt": 1, "$lte": 2}}, True),
+    ({"k": {"$lt": 2}}, False),
+    ({"missing": {"$gte": 0}}, False),
+    ({"name": {"$gt": 1}}, False),
+    ({"$and": [{"k": 2}, {"name": "a"}]}, True),
+    ({"$and": [{"k": 2}, {"name": "b"}]}, False),
+    ({"$or": [{"k": 5}, {"name": "a"}]}, True),
+])
+def test_match_where(where, expected):
+    cs.validate_where(where)
+    assert cs._match_where({"k": 2, "name": "a"}, where) is expected
+
+
+@pytest.mark.parametrize("where", [
+    {"k": {"$regex": "a"}},
+    {"$not": {"k": 1}},
+    {"k": {"$gt": "a"}},
+    {"k": {"$in": 1}},
+    {"$and": {"k": 1}},
+    {"$or": [{"k": {"$like": 1}}]},
+])
+def test_validate_where_rejects_unsupported(where):
+    with pytest.raises(ValueError):
+        cs.validate_where(where)
+
+
+def test_check_where_returns_400():
+    with pytest.raises(cs.HTTPException) as exc:
+        cs.check_where({"k": {"$regex": "a"}}, "faiss")
+    assert exc.value.status_code == 400
+    # chroma后端由Chroma自己检查
+    cs.check_where({"k": {"$regex": "a"}}, "chroma")
+
+
+# 精确检索
+
+@pytest.mark.parametrize("n_queries", [1, 3])
+def test_inner_products(n_queries):
+    matrix = _unit_vectors(50)
+    queries = _unit_vectors(n_queries, seed=1)
+    assert cs.np.allclose(cs.inner_products(queries, matrix), queries @ matrix.T, atol=1e-5)
+    assert cs.inner_products(queries, matrix[:0]).shape == (n_queries, 0)
+
+
+def test_top_k():
+    scores = cs.np.array([0.1, 0.9, 0.5, 0.7], dtype=cs.np.float32)
+    assert list(cs.top_k(scores, 2)) == [1, 3]
+    assert list(cs.top_k(scores, 10)) == [1, 3, 2, 0]
+    assert len(cs.top_k(scores, 0)) == 0
+    assert len(cs.top_k(scores[:0], 5)) == 0
+
+
+def test_mmap_query_where_matches_nothing(tmp_path):
+    collection = cs.MmapCollection("t", str(tmp_path))
+    collection.embeddings = _unit_vectors(10)
+    collection.ids = [str(i) for i in range(10)]
+    collection.documents = [""] * 10
+    collection.metadatas = [{"k": i} for i in range(10)]
+    results = collection.query(query_embeddings=_unit_vectors(2, seed=1), n_results=3, where={"k": 99})
+    assert results["ids"] == [[], []]
+
+
+# 并发查询合并
+
+def test_single_flight_survives_cancelled_first_caller():
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value
+
+    async def main():
+        first = asyncio.ensure_future(cs.single_flight(("k",), slow, 1))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cs.single_flight(("k",), slow, 2))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await follower == 1
+        assert first.cancelled()
+
+    asyncio.run(main())
+    assert calls == [1]
+    assert cs._inflight == {}
+
+
+def test_single_flight_propagates_exceptions():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        results = await asyncio.gather(*(cs.single_flight(("err",), fail) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
+    assert cs._inflight == {}
+
+
+# HTTP接口
+
+# 桩模型的固定向量，不需要下载embedding模型
+STUB_VECTORS = {
+    "甲": [1.0, 0.0, 0.0, 0.0],
+    "乙": [0.0, 1.0, 0.0, 0.0],
+    "丙": [0.8, 0.6, 0.0, 0.0],
+    "找甲": [1.0, 0.0, 0.1, 0.0],
+    "找乙": [0.0, 1.0, 0.1, 0.0],
+}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    def stub_model(texts):
+        return [cs.np.array(STUB_VECTORS[t], dtype=cs.np.float32) for t in texts]
+
+    monkeypatch.setenv("VECTOR_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(cs, "create_default_ef", lambda: (cs.CachedDefaultEmbeddingFunction(stub_model), None))
+    cs._embed_text.cache_clear()
+    with TestClient(cs.app) as test_client:
+        yield test_client
+
+
+BACKENDS = ["chroma", pytest.param("faiss", marks=pytest.mark.skipif(cs.faiss is None, reason="未安装faiss"))]
+
+
+def _ingest(client, backend):
+    response = client.post(f"/embed_batch?backend={backend}", json={
+        "ids": ["a", "b", "c"],
+        "texts": ["甲", "乙", "丙"],
+        "metadatas": [{"k": 1}, {"k": 2}, {"k": 3}],
+    })
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_returns_columns(client, backend):
+    _ingest(client, backend)
+    body = client.post(f"/query?backend={backend}", json={"query_text": "找甲", "n_results": 3}).json()
+    assert body["status"] == "success" and body["count"] == 3
+    assert body["ids"] == ["a", "c", "b"]
+    assert body["documents"] == ["甲", "丙", "乙"]
+    assert body["metadatas"] == [{"k": 1}, {"k": 3}, {"k": 2}]
+    assert len(body["distances"]) == 3 and body["distances"] == sorted(body["distances"])
+    assert body["distances"][0] == pytest.approx(1 - 1 / cs.np.sqrt(1.01), abs=1e-4)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_aos_format(client, backend):
+    _ingest(client, backend)
+    body = client.post(f"/query?backend={backend}&format=aos", json={"query_text": "找甲", "n_results": 2}).json()
+    assert body["count"] == 2
+    assert [r["id"] for r in body["results"]] == ["a", "c"]
+    assert set(body["results"][0]) == {"id", "text", "metadata", "distance"}
+    assert body["results"][1]["text"] == "丙" and body["results"][1]["metadata"] == {"k": 3}
+    assert client.post("/query?format=xml", json={"query_text": "找甲"}).status_code == 400
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_batch_keeps_input_order(client, backend):
+    _ingest(client, backend)
+    body = client.post(f"/query_batch?backend={backend}",
+                       json={"query_texts": ["找乙", "找甲"], "n_results": 2}).json()
+    assert body["count"] == 2
+    assert [r["ids"] for r in body["results"]] == [["b", "c"], ["a", "c"]]
+    assert [len(r["distances"]) for r in body["results"]] == [2, 2]
+
+    body = client.post(f"/query_batch?backend={backend}&format=aos",
+                       json={"query_embeddings": [[1.0, 0.0, 0.1, 0.0], [0.0, 1.0, 0.1, 0.0]], "n_results": 1}).json()
+    assert [[r["id"] for r in rows] for rows in body["results"]] == [["a"], ["b"]]
+
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_list_collections_before_persist(client, backend):
+    _ingest(client, backend)
+    # 延迟保存还没有触发，FAISS collection只存在于内存中
+    assert "default" in client.get(f"/collections?backend={backend}").json()["collections"]
+
+
+@pytest.mark.skipif(cs.ormsgpack is None, reason="未安装ormsgpack")
+def test_query_msgpack_negotiation(client):
+    _ingest(client, "chroma")
+    request = {"query_text": "找甲", "n_results": 3}
+    response = client.post("/query", json=request, headers={"Accept": "application/x-msgpack"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-msgpack"
+    packed = cs.ormsgpack.unpackb(response.content)
+    expected = client.post("/query", json=request).json()
+    assert packed["ids"] == expected["ids"]
+    assert cs.np.allclose(packed["distances"], expected["distances"])
+
+    response = client.post("/query_batch", json={"query_texts": ["找乙"]}, headers={"Accept": "application/x-msgpack"})
+    assert cs.ormsgpack.unpackb(response.content)["results"][0]["ids"][0] == "b"
+    # 没有要求msgpack时返回JSON
+    assert client.post("/query", json=request).headers["content-type"] == "application/json"
+
+
+def test_query_batch_rejects_empty_vectors(client):
+    response = client.post("/query_batch", json={"query_embeddings": [[]]})
+    assert response.status_code == 422
+
+
+def test_query_msgpack_without_ormsgpack(client, monkeypatch):
+    _ingest(client, "chroma")
+    monkeypatch.setattr(cs, "ormsgpack", None)
+    response = client.post("/query", json={"query_text": "找甲"}, headers={"Accept": "application/x-msgpack"})
+    assert response.status_code == 406
+
+
+# 批量接口的请求体解析
+
+def test_batch_decoder_accepts_matrix():
+    item = cs.embedding_batch_decoder.decode(
+        b'{"ids": ["a", "b"], "texts": ["x", "y"], "embeddings": [[0.1, 0.2], [0.3, 0.4]]}')
+    assert item.embeddings.shape == (2, 2)
+    item = cs.query_batch_decoder.decode(b'{"query_texts": ["x"], "query_embeddings": []}')
+    assert item.query_embeddings.size == 0
+
+
+@pytest.mark.parametrize("decoder, body", [
+    (cs.embedding_batch_decoder, b'{"ids": ["a", "b"], "texts": ["x", "y"], "embeddings": [0.1, 0.2]}'),
+    (cs.query_batch_decoder, b'{"query_embeddings": [0.1, 0.2]}'),
+    (cs.query_batch_decoder, b'{"query_embeddings": [[[0.1]]]}'),
+    (cs.query_batch_decoder, b'{"query_embeddings": [[]]}'),
+    (cs.embedding_batch_decoder, b'{"ids": ["a"], "texts": ["x"], "embeddings": [[]]}'),
+])
+def test_batch_decoder_rejects_non_matrix(decoder, body):
+    with pytest.raises(cs.msgspec.ValidationError):
+        decoder.decode(body)
+
+
+def test_batch_request_schema():
+    schema = cs.request_body_schema(cs.EmbeddingBatchItem)["requestBody"]["content"]["application/json"]["schema"]
+    assert schema["required"] == ["ids", "texts"]
+    assert "embeddings" in schema["properties"]
+
+
+# collection名称
+
+@pytest.mark.parametrize("name", ["default", "novel_1.chapters", "a-b"])
+def test_check_collection_name_accepts(name):
+    cs.check_collection_name(name)
+
+
+@pytest.mark.parametrize("name", ["", "ab", "../../escape", "a/b/c", "a\\b\\c", "a..b", ".hidden", "x" * 64])
+def test_check_collection_name_rejects(name):
+    with pytest.raises(cs.HTTPException) as exc:
+        cs.check_collection_name(name)
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("getter", ["get_faiss_collection", "get_mmap_collection"])
+def test_local_backends_reject_path_names(tmp_path, monkeypatch, getter):
+    if getter == "get_faiss_collection" and cs.faiss is None:
+        pytest.skip("未安装faiss")
+    monkeypatch.setattr(cs, "VECTOR_DB_PATH", str(tmp_path / "db"))
+    with pytest.raises(cs.HTTPException) as exc:
+        getattr(cs, getter)("../../escape")
+    assert exc.value.status_code == 400
+    assert not any(tmp_path.rglob("escape*"))
+
+
+# chroma距离换算
+
+@pytest.mark.parametrize("space", ["l2", "ip", "cosine"])
+def test_chroma_distances_are_cosine(space):
+    client = cs.chromadb.EphemeralClient()
+    collection = client.create_collection(f"distance-{space}", embedding_function=None,
+                                          metadata={"hnsw:space": space})
+    vectors = _unit_vectors(20)
+    collection.add(ids=[str(i) for i in range(20)], embeddings=vectors.tolist())
+    results = cs.to_cosine_distances(collection, collection.query(query_embeddings=vectors[:1].tolist(), n_results=5))
+    expected = 1.0 - vectors[[int(i) for i in results["ids"][0]]] @ vectors[0]
+    assert cs.np.allclose(results["distances"][0], expected, atol=1e-4)
+    client.delete_collection(f"distance-{space}")
+
+
+# mmap快照
+
+@pytest.fixture
+def chroma_collection():
+    client = cs.chromadb.EphemeralClient()
+    collection = client.create_collection("snapshot-src", embedding_function=None, metadata={"hnsw:space": "ip"})
+    yield collection
+    client.delete_collection("snapshot-src")
+
+
+def _add_vectors(collection, vectors, start=0):
+    ids = [str(i) for i in range(start, start + len(vectors))]
+    collection.add(ids=ids, embeddings=vectors.tolist(), documents=[f"doc {i}" for i in ids],
+                   metadatas=[{"k": int(i)} for i in ids])
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch, chroma_collection):
+    # 每页7条，20条向量需要分3页读取
+    monkeypatch.setattr(cs, "SNAPSHOT_PAGE_SIZE", 7)
+    vectors = _unit_vectors(20)
+    _add_vectors(chroma_collection, vectors)
+    assert cs.build_snapshot(chroma_collection, str(tmp_path), "snap") == 20
+
+    snapshot = cs.MmapCollection("snap", str(tmp_path))
+    assert snapshot.count() == 20
+    assert snapshot.embeddings.shape == (20, 16)
+    assert snapshot.documents[3] == "doc 3" and snapshot.metadatas[3] == {"k": 3}
+
+    queries = _unit_vectors(3, seed=1)
+    expected = chroma_collection.query(query_embeddings=queries.tolist(), n_results=5)
+    results = snapshot.query(query_embeddings=queries, n_results=5)
+    assert results["ids"] == expected["ids"]
+    assert results["documents"] == expected["documents"]
+    for row, expected_row in zip(results["distances"], expected["distances"]):
+        assert cs.np.allclose(row, expected_row, atol=1e-4)
+
+
+def test_snapshot_truncates_rows_missing_from_pages(tmp_path, chroma_collection):
+    class Shrinking:
+        """count()之后被删除了一部分数据，读到的行数少于预先分配的行数"""
+
+        def count(self):
+            return chroma_collection.count() + 5
+
+        def get(self, **kwargs):
+            return chroma_collection.get(**kwargs)
+
+    _add_vectors(chroma_collection, _unit_vectors(4))
+    assert cs.build_snapshot(Shrinking(), str(tmp_path), "snap") == 4
+    snapshot = cs.MmapCollection("snap", str(tmp_path))
+    assert snapshot.embeddings.shape == (4, 16)
+    assert snapshot.query(query_embeddings=_unit_vectors(1), n_results=10)["ids"][0][0] == "0"
+
+
+def test_snapshot_of_empty_collection(tmp_path, chroma_collection):
+    assert cs.build_snapshot(chroma_collection, str(tmp_path), "snap") == 0
+    snapshot = cs.MmapCollection("snap", str(tmp_path))
+    assert snapshot.exists() and snapshot.count() == 0
+    assert snapshot.query(query_embeddings=_unit_vectors(2), n_results=3)["ids"] == [[], []]
+
+
+def test_snapshot_replaces_loaded_snapshot(tmp_path, monkeypatch, chroma_collection):
+    monkeypatch.setattr(cs, "mmap_collections", {})
+    _add_vectors(chroma_collection, _unit_vectors(5))
+    cs.build_snapshot(chroma_collection, str(tmp_path), "snap")
+    cs.mmap_collections["snap"] = old = cs.MmapCollection("snap", str(tmp_path))
+
+    _add_vectors(chroma_collection, _unit_vectors(3, seed=2), start=5)
+    assert cs.build_snapshot(chroma_collection, str(tmp_path), "snap") == 8
+    # 旧快照从缓存中移除，下次访问时重新加载
+    assert "snap" not in cs.mmap_collections
+    assert old.count() == 5
+    assert cs.MmapCollection("snap", str(tmp_path)).count() == 8
+    assert not any(p.name.endswith(".tmp") for p in tmp_path.iterdir())
+
+
+# FAISS collection
+
+requires_faiss = pytest.mark.skipif(cs.faiss is None, reason="未安装faiss")
+
+
+@requires_faiss
+def test_faiss_overwrite_and_delete(tmp_path):
+    collection = cs.FaissCollection("t", str(tmp_path))
+    vectors = _unit_vectors(8)
+    collection.add([str(i) for i in range(8)], vectors, metadatas=[{"i": i} for i in range(8)], persist=False)
+
+    # 覆盖后旧向量不再返回
+    collection.add(["0"], vectors[1:2], metadatas=[{"i": 100}], persist=False)
+    results = collection.query(vectors[:1], n_results=8)
+    assert results["ids"][0].count("0") == 1
+
+    collection.delete(ids=["1", "2"])
+    results = collection.query(vectors[1:2], n_results=8)
+    assert "1" not in results["ids"][0] and "2" not in results["ids"][0]
+    assert len(results["ids"][0]) == collection.count() == 6
+
+
+@requires_faiss
+def test_faiss_compacts_dead_vectors(tmp_path):
+    collection = cs.FaissCollection("t", str(tmp_path))
+    ids = [str(i) for i in range(100)]
+    for seed in range(5):
+        collection.add(ids, _unit_vectors(100, seed=seed), persist=False)
+    # 重复写入相同ID后，失效向量会被移除，不会无限增长
+    assert collection.index.ntotal <= 100 * (1 + cs.FAISS_COMPACT_RATIO)
+    vectors = _unit_vectors(100, seed=4)
+    results = collection.query(vectors[:10], n_results=1)
+    assert [r[0] for r in results["ids"]] == ids[:10]
+
+
+@requires_faiss
+def test_faiss_flush_and_reload(tmp_path):
+    collection = cs.FaissCollection("t", str(tmp_path))
+    vectors = _unit_vectors(4)
+    collection.add(["a", "b", "c", "d"], vectors, documents=["A", "B", "C", "D"])
+    collection.flush()
+    reloaded = cs.FaissCollection("t", str(tmp_path))
+    assert reloaded.count() == 4
+    assert reloaded.query(vectors[2:3], n_results=1)["documents"] == [["C"]]
+
+
+def test_read_write_lock():
+    lock = cs.ReadWriteLock()
+    readers_inside = threading.Barrier(2, timeout=5)
+
+    def reader():
+        with lock.read():
+            # 两个读者必须同时持有读锁才能通过
+            readers_inside.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    entered = threading.Event()
+
+    def write():
+        with lock.write():
+            entered.set()
+
+    writer = threading.Thread(target=write)
+    with lock.read():
+        writer.start()
+        assert not entered.wait(0.1)
+    assert entered.wait(5)
+    writer.join()
+
+
+@requires_faiss
+def test_faiss_query_during_persist(tmp_path, monkeypatch):
+    collection = cs.FaissCollection("t", str(tmp_path))
+    vectors = _unit_vectors(10)
+    collection.add([str(i) for i in range(10)], vectors, persist=False)
+
+    writing, release = threading.Event(), threading.Event()
+    dump = cs.json.dump
+
+    def slow_dump(*args, **kwargs):
+        writing.set()
+        release.wait(5)
+        dump(*args, **kwargs)
+
+    monkeypatch.setattr(cs.json, "dump", slow_dump)
+    saver = threading.Thread(target=collection.persist)
+    saver.start()
+    assert writing.wait(5)
+    # 写磁盘时不持有collection的锁，查询和写入都不需要等待
+    assert collection.query(vectors[:1], n_results=1)["ids"] == [["0"]]
+    collection.add(["new"], vectors[1:2], persist=False)
+    release.set()
+    saver.join()
+    assert cs.FaissCollection("t", str(tmp_path)).count() == 10
+
+
+@requires_faiss
+@pytest.mark.parametrize("quantization, first_batch", [(None, 300), ("int8", 1), ("int8", 300)])
+def test_faiss_inner_product_distances(tmp_path, quantization, first_batch):
+    vectors = _unit_vectors(300, dim=64)
+    queries = _unit_vectors(20, dim=64, seed=1)
+    collection = cs.FaissCollection("t", str(tmp_path), quantization=quantization)
+    ids = [str(i) for i in range(300)]
+    # 量化的缩放系数不受第一次写入的数据影响
+    collection.add(ids[:first_batch], vectors[:first_batch], persist=False)
+    if first_batch < len(ids):
+        collection.add(ids[first_batch:], vectors[first_batch:], persist=False)
+    collection.flush()
+
+    for current in (collection, cs.FaissCollection("t", str(tmp_path))):
+        results = current.query(queries, n_results=5)
+        exact = queries @ vectors.T
+        for j, row in enumerate(results["ids"]):
+            expected = 1.0 - exact[j, [int(i) for i in row]]
+            # 距离为1 - 内积，量化误差很小
+            assert cs.np.allclose(results["distances"][j], expected, atol=0.02)
+
+
+@requires_faiss
+def test_faiss_binary_distance_is_bit_fraction(tmp_path):
+    vectors = _unit_vectors(50, dim=64)
+    collection = cs.FaissCollection("t", str(tmp_path), quantization="binary")
+    collection.add([str(i) for i in range(50)], vectors, persist=False)
+    results = collection.query(vectors[:2], n_results=5)
+    bits = vectors > 0
+    for j, row in enumerate(results["ids"]):
+        expected = [(bits[j] != bits[int(i)]).mean() for i in row]
+        assert cs.np.allclose(results["distances"][j], expected)
+    assert results["distances"][0][0] == 0.0
+
+
+# 默认模型的int8量化
+
+class _FakeModel:
+    EXTRACTED_FOLDER_NAME = "onnx"
+
+    def __init__(self, download_path):
+        self.DOWNLOAD_PATH = download_path
+        self.model = None
+
+    def _download_model_if_not_exists(self):
+        pass
+
+
+@pytest.mark.skipif(cs.onnxruntime is None, reason="未安装onnx")
+def test_quantize_default_model(tmp_path):
+    import onnx
+    from onnx import helper, numpy_helper
+    weight = numpy_helper.from_array(_unit_vectors(64, dim=32).astype(cs.np.float32), "w")
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["x", "w"], ["y"])], "g",
+        [helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, [None, 64])],
+        [helper.make_tensor_value_info("y", onnx.TensorProto.FLOAT, [None, 32])],
+        initializer=[weight])
+    (tmp_path / "onnx").mkdir()
+    onnx.save(helper.make_model(graph, ir_version=10, opset_imports=[helper.make_opsetid("", 17)]),
+              str(tmp_path / "onnx" / "model.onnx"))
+
+    model = _FakeModel(str(tmp_path))
+    cs.quantize_default_model(model, workers=1)
+    assert (tmp_path / "onnx" / "model.int8.onnx").exists()
+    options = model.model.get_session_options()
+    assert options.graph_optimization_level == cs.onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    x = _unit_vectors(2, dim=64, seed=1).astype(cs.np.float32)
+    y = model.model.run(None, {"x": x})[0]
+    assert cs.np.allclose(y, x @ _unit_vectors(64, dim=32).astype(cs.np.float32), atol=0.05)
@@ -641,7 +641,14 @@ export class VectorService {
       
       const response = await this.httpRequest(`/query?collection_name=${collectionName}`, 'POST', data);
       const responseData = JSON.parse(response);
-      return responseData.results || [];
+      // 服务端按列返回结果，这里转换为逐条的结果对象
+      const ids: string[] = responseData.ids || [];
+      return ids.map((id, i) => ({
+        id,
+        text: responseData.documents ? responseData.documents[i] : null,
+        metadata: (responseData.metadatas && responseData.metadatas[i]) || {},
+        distance: responseData.distances ? responseData.distances[i] : null
+      }));
     } catch (error) {
       logger.error('查询相似向量失败:', error as Error);
       throw error;